@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import threading
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
 
-from sqlalchemy import select
+import numpy as np
+from sqlalchemy import bindparam, select
 
 from .config import PROGRAMS
 from .db import SessionLocal
@@ -17,105 +20,213 @@ class AdmissionResult:
     consent_count: int
 
 
-def _get_latest_snapshot_id(db, day: str) -> int | None:
+# Results per snapshot key (see get_latest_snapshot). Snapshots never change
+# once imported, so an entry never goes stale.
+_CACHE_SIZE = 8
+_cache: Dict[Tuple[int, datetime], Dict[str, AdmissionResult]] = {}
+_cache_lock = threading.Lock()
+
+# Program code by id. Programs are created by init_db and only change when
+# reset_db recreates the tables.
+_program_codes: Dict[int, str] | None = None
+
+
+def clear_caches() -> None:
+    global _program_codes
+    _program_codes = None
+    with _cache_lock:
+        _cache.clear()
+
+
+def get_program_codes(db) -> Dict[int, str]:
+    global _program_codes
+    if _program_codes is None:
+        codes = dict(db.execute(select(Program.id, Program.code)).all())
+        if not codes:
+            # programs not created yet; do not cache the empty table
+            return codes
+        _program_codes = codes
+    return _program_codes
+
+
+# Built once; the day is a bound parameter so the compiled form is reused
+_LATEST_SNAPSHOT_STMT = (
+    select(Snapshot.id, Snapshot.imported_at)
+    .where(Snapshot.day == bindparam("day"))
+    .order_by(Snapshot.imported_at.desc())
+    .limit(1)
+)
+
+
+def get_latest_snapshot(db, day: str):
+    """(id, imported_at) of the day's newest snapshot, or None.
+
+    Snapshot ids start over after a reset, which may happen in another
+    process, so a snapshot's contents are identified by the pair. The
+    admission cache, page ETags and report versions all key on it.
+    """
+    return db.execute(_LATEST_SNAPSHOT_STMT, {"day": day}).first()
+
+
+def get_latest_snapshot_id(db, day: str) -> int | None:
+    return db.execute(_LATEST_SNAPSHOT_STMT, {"day": day}).scalar()
+
+
+def get_latest_snapshots(db, days: Iterable[str]) -> Dict[str, Tuple[int, datetime]]:
+    # snapshots is tiny: read all of them in import order and let the newest
+    # one of each day win
     stmt = (
-        select(Snapshot)
-        .where(Snapshot.day == day)
-        .order_by(Snapshot.imported_at.desc())
-        .limit(1)
+        select(Snapshot.day, Snapshot.id, Snapshot.imported_at)
+        .where(Snapshot.day.in_(list(days)))
+        .order_by(Snapshot.imported_at)
     )
-    snap = db.execute(stmt).scalars().first()
-    return snap.id if snap else None
+    return {day: (snapshot_id, imported_at) for day, snapshot_id, imported_at in db.execute(stmt)}
 
 
-def compute_admission(day: str, db=None) -> Dict[str, AdmissionResult]:
+def _run_admission(apps, program_codes: Dict[int, str]) -> Dict[str, AdmissionResult]:
+    codes = list(PROGRAMS)
+    program_idx_by_id = {
+        program_id: codes.index(code) for program_id, code in program_codes.items()
+    }
+
+    # Structure-of-arrays view of the consenting applications
+    n_apps = len(apps)
+    aid = np.fromiter((a.applicant_id for a in apps), dtype=np.int64, count=n_apps)
+    pid = np.fromiter(
+        (program_idx_by_id[a.program_id] for a in apps), dtype=np.int32, count=n_apps
+    )
+    prio = np.fromiter((a.priority for a in apps), dtype=np.int32, count=n_apps)
+    tot = np.fromiter((a.total for a in apps), dtype=np.int32, count=n_apps)
+
+    consent_count = np.bincount(pid, minlength=len(codes))
+
+    # Compact applicant index and preference matrix of row ids sorted by priority
+    _, applicant_idx = np.unique(aid, return_inverse=True)
+    pref_len = np.bincount(applicant_idx, minlength=applicant_idx.max(initial=-1) + 1)
+    n_applicants = len(pref_len)
+    pref_start = np.cumsum(pref_len) - pref_len
+    by_pref = np.lexsort((prio, applicant_idx))
+    slot = np.arange(n_apps) - pref_start[applicant_idx[by_pref]]
+    pref = np.full((n_applicants, pref_len.max(initial=0)), -1, dtype=np.intp)
+    pref[applicant_idx[by_pref], slot] = by_pref
+
+    capacities = np.array([PROGRAMS[code]["seats"] for code in codes])
+
+    # Position of every row in (program, -total, applicant_id) order
+    ranking = np.lexsort((aid, -tot, pid))
+    position = np.empty(n_apps, dtype=np.intp)
+    position[ranking] = np.arange(n_apps)
+
+    # Deferred acceptance with score-based ranking; all programs are
+    # resolved together in a single vectorized pass per round. Held rows
+    # are kept as sorted positions, so a round only sorts the incoming
+    # proposals and merges them in.
+    held = np.empty(0, dtype=np.intp)
+    unassigned = np.ones(n_applicants, dtype=bool)
+    next_choice = np.zeros(n_applicants, dtype=np.intp)
+    # Position of the worst held row of every full program; proposals
+    # ranked below it are sure to be rejected and never reach the merge.
+    cutoff_position = np.full(len(codes), n_apps, dtype=np.intp)
+
+    while True:
+        proposers = np.flatnonzero(unassigned & (next_choice < pref_len))
+        if proposers.size == 0:
+            break
+        proposals = pref[proposers, next_choice[proposers]]
+        next_choice[proposers] += 1
+
+        incoming = position[proposals]
+        incoming = np.sort(incoming[incoming < cutoff_position[pid[proposals]]])
+        if incoming.size == 0:
+            continue
+
+        candidates = np.insert(held, np.searchsorted(held, incoming), incoming)
+        rows = ranking[candidates]
+        program = pid[rows]
+        seat = np.arange(candidates.size) - np.searchsorted(program, program)
+        keep = seat < capacities[program]
+        held = candidates[keep]
+        # an applicant has at most one candidate row per round, so one
+        # scatter marks rejected rows unassigned and held rows assigned
+        unassigned[applicant_idx[rows]] = ~keep
+
+        held_count = np.bincount(program[keep], minlength=len(codes))
+        full = held_count >= capacities
+        cutoff_position[full] = held[np.cumsum(held_count)[full] - 1]
+
+    # held positions are sorted, so each program's rows are already
+    # ordered by score desc, applicant_id asc
+    held_rows = ranking[held]
+    results: Dict[str, AdmissionResult] = {}
+    for p, code in enumerate(codes):
+        accepted = held_rows[pid[held_rows] == p]
+        admitted = list(zip(aid[accepted].tolist(), tot[accepted].tolist()))
+        if len(admitted) < capacities[p]:
+            cutoff = None
+        else:
+            cutoff = admitted[-1][1]
+        results[code] = AdmissionResult(admitted, cutoff, int(consent_count[p]))
+
+    return results
+
+
+def compute_admissions(
+    days: Iterable[str], db=None
+) -> Dict[str, Dict[str, AdmissionResult]]:
+    days = list(days)
     close_db = False
     if db is None:
         db = SessionLocal()
         close_db = True
 
     try:
-        snapshot_id = _get_latest_snapshot_id(db, day)
-        if snapshot_id is None:
-            return {code: AdmissionResult([], None, 0) for code in PROGRAMS}
-
-        programs = {p.id: p for p in db.execute(select(Program)).scalars().all()}
-
-        stmt = select(ApplicationSnapshot).where(
-            ApplicationSnapshot.snapshot_id == snapshot_id,
-            ApplicationSnapshot.consent == True,  # noqa: E712
-        )
-        apps = db.execute(stmt).scalars().all()
-
-        # Build applicant preferences and scores
-        prefs: Dict[int, List[Tuple[int, str]]] = {}
-        scores: Dict[Tuple[int, str], int] = {}
-        consent_count: Dict[str, int] = {code: 0 for code in PROGRAMS}
-
-        program_code_by_id = {p.id: p.code for p in programs.values()}
-
-        for app in apps:
-            code = program_code_by_id[app.program_id]
-            consent_count[code] += 1
-            prefs.setdefault(app.applicant_id, []).append((app.priority, code))
-            scores[(app.applicant_id, code)] = app.total
-
-        # sort preferences by priority
-        applicant_prefs: Dict[int, List[str]] = {}
-        for aid, items in prefs.items():
-            items.sort(key=lambda x: x[0])
-            applicant_prefs[aid] = [code for _, code in items]
-
-        capacities = {code: PROGRAMS[code]["seats"] for code in PROGRAMS}
-
-        # Deferred acceptance with score-based ranking
-        tentative: Dict[str, List[int]] = {code: [] for code in PROGRAMS}
-        unassigned = set(applicant_prefs.keys())
-        next_choice = {aid: 0 for aid in applicant_prefs}
-
-        while True:
-            proposals: Dict[str, List[int]] = {}
-            progressed = False
-            for aid in list(unassigned):
-                idx = next_choice[aid]
-                pref_list = applicant_prefs[aid]
-                if idx >= len(pref_list):
-                    unassigned.remove(aid)
+        snapshots = get_latest_snapshots(db, days)
+        results: Dict[str, Dict[str, AdmissionResult]] = {}
+        missing: Dict[int, Tuple[str, Tuple[int, datetime]]] = {}
+        with _cache_lock:
+            for day in days:
+                key = snapshots.get(day)
+                if key is None:
+                    results[day] = {code: AdmissionResult([], None, 0) for code in PROGRAMS}
                     continue
-                program = pref_list[idx]
-                proposals.setdefault(program, []).append(aid)
-                next_choice[aid] += 1
-                progressed = True
-
-            if not progressed:
-                break
-
-            for program, new_applicants in proposals.items():
-                candidates = tentative.get(program, []) + new_applicants
-                candidates.sort(key=lambda a: (-scores[(a, program)], a))
-                capacity = capacities[program]
-                accepted = candidates[:capacity]
-                tentative[program] = accepted
-
-                rejected = set(candidates[capacity:])
-                for aid in rejected:
-                    unassigned.add(aid)
-                for aid in accepted:
-                    if aid in unassigned:
-                        unassigned.remove(aid)
-
-        results: Dict[str, AdmissionResult] = {}
-        for code in PROGRAMS:
-            accepted_ids = tentative.get(code, [])
-            accepted_ids.sort(key=lambda a: (-scores[(a, code)], a))
-            admitted = [(aid, scores[(aid, code)]) for aid in accepted_ids]
-            if len(admitted) < PROGRAMS[code]["seats"]:
-                cutoff = None
-            else:
-                cutoff = admitted[-1][1]
-            results[code] = AdmissionResult(admitted, cutoff, consent_count.get(code, 0))
-
-        return results
+                cached = _cache.pop(key, None)
+                if cached is None:
+                    missing[key[0]] = (day, key)
+                else:
+                    _cache[key] = cached
+                    results[day] = cached
+
+        if missing:
+            # consenting rows of every uncached snapshot in one query
+            stmt = select(
+                ApplicationSnapshot.snapshot_id,
+                ApplicationSnapshot.applicant_id,
+                ApplicationSnapshot.program_id,
+                ApplicationSnapshot.priority,
+                ApplicationSnapshot.total,
+            ).where(
+                ApplicationSnapshot.snapshot_id.in_(list(missing)),
+                ApplicationSnapshot.consent == True,  # noqa: E712
+            )
+            apps_by_snapshot: Dict[int, list] = {snapshot_id: [] for snapshot_id in missing}
+            for row in db.execute(stmt):
+                apps_by_snapshot[row.snapshot_id].append(row)
+
+            program_codes = get_program_codes(db)
+            for snapshot_id, apps in apps_by_snapshot.items():
+                day, key = missing[snapshot_id]
+                day_results = _run_admission(apps, program_codes)
+                results[day] = day_results
+                with _cache_lock:
+                    _cache[key] = day_results
+                    while len(_cache) > _CACHE_SIZE:
+                        del _cache[next(iter(_cache))]
+
+        return {day: results[day] for day in days}
     finally:
         if close_db:
-            db.close()
\ No newline at end of file
+            db.close()
+
+
+def compute_admission(day: str, db=None) -> Dict[str, AdmissionResult]:
+    return compute_admissions([day], db=db)[day]
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = "sqlite:///./admission.db"
@@ -9,8 +9,24 @@ engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False},
     future=True,
+    # room for every page/report statement variant, so compiled SQL is reused
+    query_cache_size=1200,
 )
 
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _connection_record) -> None:
+    # WAL lets page reads run alongside an import; NORMAL sync is still
+    # crash-safe in WAL mode and skips most fsyncs.
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
 Base = declarative_base()
@@ -22,4 +38,3 @@ def get_db():
         yield db
     finally:
         db.close()
- 
\ No newline at end of file
@@ -5,15 +5,51 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, Iterable, List
 
-from sqlalchemy import select
+from sqlalchemy import delete, insert, select
 
+from .admission import clear_caches, get_program_codes
 from .config import DAY_FOLDERS, DAYS, PROGRAMS
 from .db import Base, SessionLocal, engine
 from .models import Applicant, Application, ApplicationSnapshot, Program, Snapshot
 
 
+def _rebuild_plain_total_tables(conn) -> None:
+    # total used to be an ordinary column written by the importer. create_all
+    # leaves such tables as they are and every import would then fail on its
+    # NOT NULL constraint, so rebuild them around the generated column.
+    for table in (ApplicationSnapshot.__table__, Application.__table__):
+        hidden = {
+            row[1]: row[6] for row in conn.exec_driver_sql(f"PRAGMA table_xinfo({table.name})")
+        }
+        # 2/3 mark virtual/stored generated columns; a missing table is left
+        # to create_all
+        if hidden.get("total", 3) in (2, 3):
+            continue
+        old_name = f"{table.name}_old"
+        conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO {old_name}")
+        # index names are schema-wide; the renamed table still holds them
+        index_names = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master"
+            " WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (old_name,),
+        ).scalars().all()
+        for index_name in index_names:
+            conn.exec_driver_sql(f'DROP INDEX "{index_name}"')
+        table.create(conn)
+        columns = ", ".join(c.name for c in table.columns if c.name != "total")
+        conn.exec_driver_sql(
+            f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}"
+        )
+        conn.exec_driver_sql(f"DROP TABLE {old_name}")
+
+
 def init_db() -> None:
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _rebuild_plain_total_tables(conn)
+    # create_all skips existing tables, so add indexes introduced later
+    for index in ApplicationSnapshot.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
     with SessionLocal() as db:
         existing = {p.code for p in db.execute(select(Program)).scalars().all()}
         for code, info in PROGRAMS.items():
@@ -24,10 +60,24 @@ def init_db() -> None:
 
 def reset_db() -> None:
     Base.metadata.drop_all(bind=engine)
+    clear_caches()
     Base.metadata.create_all(bind=engine)
     init_db()
 
 
+_INT_COLUMNS = (
+    "applicant_id",
+    "priority",
+    "physics_ikt",
+    "russian",
+    "math",
+    "achievements",
+)
+_ROW_KEYS = ("consent",) + _INT_COLUMNS
+
+_BATCH_SIZE = 1000
+
+
 def _parse_consent(value: str) -> bool:
     v = value.strip().lower()
     return v in {"1", "true", "yes", "y"}
@@ -45,24 +95,36 @@ def _load_day_rows(day: str, data_dir: str = "data") -> List[Dict]:
         if not path.exists():
             raise FileNotFoundError(str(path))
         with path.open("r", newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for r in reader:
-                rows.append(
-                    {
-                        "program_code": code,
-                        "applicant_id": int(r["applicant_id"]),
-                        "consent": _parse_consent(r["consent"]),
-                        "priority": int(r["priority"]),
-                        "physics_ikt": int(r["physics_ikt"]),
-                        "russian": int(r["russian"]),
-                        "math": int(r["math"]),
-                        "achievements": int(r["achievements"]),
-                        "total": int(r["total"]),
-                    }
+            reader = csv.reader(f)
+            # csv.reader yields blank lines as [] (DictReader skipped them)
+            records = [record for record in reader if record]
+        header = records.pop(0) if records else []
+        if not header:
+            # empty file: no rows, as DictReader had it
+            continue
+        missing = [name for name in _ROW_KEYS if name not in header]
+        if missing:
+            raise ValueError(f"{path}: header is missing columns {missing}")
+        for record in records:
+            if len(record) != len(header):
+                raise ValueError(
+                    f"{path}: expected {len(header)} fields, got {len(record)}: {record}"
                 )
+        columns = dict(zip(header, list(zip(*records)) or [()] * len(header)))
+        parsed = [map(int, columns[name]) for name in _INT_COLUMNS]
+        consent = map(_parse_consent, columns["consent"])
+        for values in zip(consent, *parsed):
+            row = dict(zip(_ROW_KEYS, values))
+            row["program_code"] = code
+            rows.append(row)
     return rows
 
 
+def _batches(items: List[Dict], size: int = _BATCH_SIZE) -> Iterable[List[Dict]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
 def import_day(day: str, data_dir: str = "data") -> int:
     if day not in DAYS:
         raise ValueError(f"Unknown day: {day}")
@@ -70,91 +132,40 @@ def import_day(day: str, data_dir: str = "data") -> int:
     init_db()
     rows = _load_day_rows(day, data_dir)
 
-    with SessionLocal() as db:
-        program_map = {p.code: p for p in db.execute(select(Program)).scalars().all()}
+    # One transaction for the whole import; rows go through Core executemany
+    with engine.begin() as conn:
+        program_ids = {code: program_id for program_id, code in get_program_codes(conn).items()}
 
-        snapshot = Snapshot(day=day, imported_at=datetime.utcnow())
-        db.add(snapshot)
-        db.flush()
+        snapshot_id = conn.execute(
+            insert(Snapshot.__table__).values(day=day, imported_at=datetime.utcnow())
+        ).inserted_primary_key[0]
 
-        applicant_ids = {r["applicant_id"] for r in rows}
-        if applicant_ids:
-            existing_ids = set(
-                db.execute(select(Applicant.id).where(Applicant.id.in_(applicant_ids))).scalars().all()
-            )
-        else:
-            existing_ids = set()
+        # the primary key skips applicants already known from earlier days
+        applicants = [{"id": aid} for aid in {r["applicant_id"] for r in rows}]
+        for batch in _batches(applicants):
+            conn.execute(insert(Applicant.__table__).prefix_with("OR IGNORE"), batch)
 
-        new_applicants = [Applicant(id=aid) for aid in applicant_ids if aid not in existing_ids]
-        if new_applicants:
-            db.bulk_save_objects(new_applicants)
-            db.flush()
-
-        snapshot_rows = []
+        app_rows = []
         for r in rows:
-            program = program_map[r["program_code"]]
-            snapshot_rows.append(
-                ApplicationSnapshot(
-                    snapshot_id=snapshot.id,
-                    applicant_id=r["applicant_id"],
-                    program_id=program.id,
-                    consent=r["consent"],
-                    priority=r["priority"],
-                    physics_ikt=r["physics_ikt"],
-                    russian=r["russian"],
-                    math=r["math"],
-                    achievements=r["achievements"],
-                    total=r["total"],
-                )
+            values = {k: v for k, v in r.items() if k != "program_code"}
+            values["program_id"] = program_ids[r["program_code"]]
+            app_rows.append(values)
+
+        for batch in _batches(app_rows):
+            conn.execute(
+                insert(ApplicationSnapshot.__table__),
+                [{**values, "snapshot_id": snapshot_id} for values in batch],
             )
-        if snapshot_rows:
-            db.bulk_save_objects(snapshot_rows)
 
-        existing_apps = {
-            (a.applicant_id, a.program_id): a
-            for a in db.execute(select(Application)).scalars().all()
-        }
-
-        new_keys = set()
-        for r in rows:
-            program = program_map[r["program_code"]]
-            key = (r["applicant_id"], program.id)
-            new_keys.add(key)
-            if key in existing_apps:
-                app = existing_apps[key]
-                app.consent = r["consent"]
-                app.priority = r["priority"]
-                app.physics_ikt = r["physics_ikt"]
-                app.russian = r["russian"]
-                app.math = r["math"]
-                app.achievements = r["achievements"]
-                app.total = r["total"]
-                app.day = day
-            else:
-                db.add(
-                    Application(
-                        applicant_id=r["applicant_id"],
-                        program_id=program.id,
-                        consent=r["consent"],
-                        priority=r["priority"],
-                        physics_ikt=r["physics_ikt"],
-                        russian=r["russian"],
-                        math=r["math"],
-                        achievements=r["achievements"],
-                        total=r["total"],
-                        day=day,
-                    )
-                )
-
-        if existing_apps:
-            to_delete = [
-                app for key, app in existing_apps.items() if key not in new_keys
-            ]
-            for app in to_delete:
-                db.delete(app)
+        # applications only mirrors the latest imported day
+        conn.execute(delete(Application.__table__))
+        for batch in _batches(app_rows):
+            conn.execute(
+                insert(Application.__table__),
+                [{**values, "day": day} for values in batch],
+            )
 
-        db.commit()
-        return snapshot.id
+    return snapshot_id
 
 
 def available_days(data_dir: str = "data") -> List[str]:
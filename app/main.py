@@ -1,20 +1,23 @@
 from __future__ import annotations
 
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
+import threading
 import time
 from typing import Optional
 
 from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import select, func
+from sqlalchemy import func, or_, select
 
-from .admission import compute_admission
+from .admission import compute_admission, get_latest_snapshot, get_program_codes
 from .config import DAYS, PROGRAMS, PROGRAM_ORDER
 from .db import SessionLocal
 from .importer import import_day, reset_db, init_db
-from .models import ApplicationSnapshot, Program, Snapshot
+from .models import ApplicationSnapshot, Snapshot
 from .report import generate_report
 
 app = FastAPI(title="Анализ поступления")
@@ -26,12 +29,25 @@ app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="stat
 
 PAGE_SIZE = 200
 
+REPORTS_DIR = Path("reports")
+# concurrent requests for the same report should not render it twice
+_report_lock = threading.Lock()
+
 
 def _latest_imported_day(db) -> Optional[str]:
-    snap = (
-        db.execute(select(Snapshot).order_by(Snapshot.imported_at.desc())).scalars().first()
-    )
-    return snap.day if snap else None
+    return db.execute(
+        select(Snapshot.day).order_by(Snapshot.imported_at.desc()).limit(1)
+    ).scalar()
+
+
+def _data_version(db) -> str:
+    # Newest snapshot key (see get_latest_snapshot); it changes with every
+    # import. Reports chart all days, so any import invalidates every cached
+    # report.
+    max_id, max_imported_at = db.execute(
+        select(func.max(Snapshot.id), func.max(Snapshot.imported_at))
+    ).one()
+    return f"{max_id}-{max_imported_at}"
 
 
 @app.on_event("startup")
@@ -45,6 +61,10 @@ def index(
     day: Optional[str] = None,
     program: Optional[str] = None,
     page: int = 1,
+    after_total: Optional[int] = None,
+    after_aid: Optional[int] = None,
+    before_total: Optional[int] = None,
+    before_aid: Optional[int] = None,
 ):
     with SessionLocal() as db:
         if day is None:
@@ -75,26 +95,29 @@ def index(
         if page < 1:
             page = 1
 
-        snapshot = (
-            db.execute(
-                select(Snapshot)
-                .where(Snapshot.day == day)
-                .order_by(Snapshot.imported_at.desc())
-                .limit(1)
-            )
-            .scalars()
-            .first()
-        )
-        if snapshot is None:
+        snapshot = get_latest_snapshot(db, day)
+        snapshot_id = snapshot.id if snapshot is not None else None
+        etag = None
+        if snapshot is not None:
+            # A snapshot never changes after import, so its key (see
+            # get_latest_snapshot) plus the page parameters fully determine
+            # the rendered page.
+            cursor = f"{after_total}-{after_aid}-{before_total}-{before_aid}"
+            imported = f"{snapshot.imported_at:%Y%m%d%H%M%S%f}"
+            etag = f'W/"{snapshot_id}-{imported}-{program}-{page}-{cursor}"'
+            if_none_match = request.headers.get("if-none-match", "")
+            if etag in (tag.strip() for tag in if_none_match.split(",")):
+                return Response(status_code=304, headers={"ETag": etag})
+
+        if snapshot_id is None:
             program_rows = []
             unified_rows = []
             cutoff_rows = []
             total_count = 0
             page_count = 1
         else:
-            programs = {p.id: p for p in db.execute(select(Program)).scalars().all()}
-            code_by_id = {p.id: p.code for p in programs.values()}
-            id_by_code = {p.code: p.id for p in programs.values()}
+            code_by_id = get_program_codes(db)
+            id_by_code = {code: program_id for program_id, code in code_by_id.items()}
 
             # Program table
             total_count = (
@@ -102,7 +125,7 @@ def index(
                     select(func.count())
                     .select_from(ApplicationSnapshot)
                     .where(
-                        ApplicationSnapshot.snapshot_id == snapshot.id,
+                        ApplicationSnapshot.snapshot_id == snapshot_id,
                         ApplicationSnapshot.program_id == id_by_code[program],
                     )
                 )
@@ -111,24 +134,34 @@ def index(
             page_count = max(1, (total_count + PAGE_SIZE - 1) // PAGE_SIZE)
             if page > page_count:
                 page = page_count
-            offset = (page - 1) * PAGE_SIZE
-            rows = (
-                db.execute(
-                    select(ApplicationSnapshot)
-                    .where(
-                        ApplicationSnapshot.snapshot_id == snapshot.id,
-                        ApplicationSnapshot.program_id == id_by_code[program],
-                    )
-                    .order_by(
-                        ApplicationSnapshot.total.desc(),
-                        ApplicationSnapshot.applicant_id.asc(),
-                    )
-                    .limit(PAGE_SIZE)
-                    .offset(offset)
-                )
-                .scalars()
-                .all()
+            # Keyset pagination: Next/Back links carry the boundary row of the
+            # current page, so any page is an index range scan. A bare page
+            # number still works through OFFSET.
+            total = ApplicationSnapshot.total
+            applicant_id = ApplicationSnapshot.applicant_id
+            stmt = select(ApplicationSnapshot).where(
+                ApplicationSnapshot.snapshot_id == snapshot_id,
+                ApplicationSnapshot.program_id == id_by_code[program],
             )
+            backwards = False
+            if after_total is not None and after_aid is not None:
+                stmt = stmt.where(
+                    total <= after_total,
+                    or_(total < after_total, applicant_id > after_aid),
+                ).order_by(total.desc(), applicant_id.asc())
+            elif before_total is not None and before_aid is not None:
+                backwards = True
+                stmt = stmt.where(
+                    total >= before_total,
+                    or_(total > before_total, applicant_id < before_aid),
+                ).order_by(total.asc(), applicant_id.desc())
+            else:
+                stmt = stmt.order_by(total.desc(), applicant_id.asc()).offset(
+                    (page - 1) * PAGE_SIZE
+                )
+            rows = db.execute(stmt.limit(PAGE_SIZE)).scalars().all()
+            if backwards:
+                rows.reverse()
             program_rows = [
                 {
                     "applicant_id": r.applicant_id,
@@ -144,24 +177,24 @@ def index(
             ]
 
             # Unified list
-            all_rows = (
-                db.execute(
-                    select(ApplicationSnapshot).where(ApplicationSnapshot.snapshot_id == snapshot.id)
+            chain_rows = db.execute(
+                select(
+                    ApplicationSnapshot.applicant_id,
+                    ApplicationSnapshot.priority,
+                    ApplicationSnapshot.program_id,
                 )
-                .scalars()
-                .all()
+                .where(ApplicationSnapshot.snapshot_id == snapshot_id)
+                .order_by(ApplicationSnapshot.applicant_id, ApplicationSnapshot.priority)
             )
-            by_applicant = {}
-            for r in all_rows:
-                by_applicant.setdefault(r.applicant_id, []).append(
-                    (r.priority, code_by_id[r.program_id])
-                )
-            unified_rows = []
-            for aid, items in by_applicant.items():
-                items.sort(key=lambda x: x[0])
-                chain = ", ".join(f"{code}({prio})" for prio, code in items)
-                unified_rows.append({"applicant_id": aid, "chain": chain})
-            unified_rows.sort(key=lambda x: x["applicant_id"])
+            unified_rows = [
+                {
+                    "applicant_id": aid,
+                    "chain": ", ".join(
+                        f"{code_by_id[program_id]}({prio})" for _, prio, program_id in items
+                    ),
+                }
+                for aid, items in groupby(chain_rows, key=itemgetter(0))
+            ]
 
             # Cutoffs
             admission = compute_admission(day, db=db)
@@ -177,7 +210,7 @@ def index(
                     }
                 )
 
-        return TEMPLATES.TemplateResponse(
+        response = TEMPLATES.TemplateResponse(
             "index.html",
             {
                 "request": request,
@@ -195,6 +228,10 @@ def index(
                 "message": None,
             },
         )
+        if etag is not None:
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+        return response
 
 
 @app.post("/api/import/{day}")
@@ -216,13 +253,23 @@ def api_reset():
 
 @app.get("/api/report/{day}.pdf")
 def api_report(day: str):
-    reports_dir = Path("reports")
-    reports_dir.mkdir(exist_ok=True)
-    path = reports_dir / f"report_{day}.pdf"
+    REPORTS_DIR.mkdir(exist_ok=True)
+    path = REPORTS_DIR / f"report_{day}.pdf"
+    version_path = path.with_suffix(".version")
+    with SessionLocal() as db:
+        version = _data_version(db)
     started = time.perf_counter()
-    generate_report(day, str(path))
+    with _report_lock:
+        cached = (
+            path.exists()
+            and version_path.exists()
+            and version_path.read_text(encoding="utf-8") == version
+        )
+        if not cached:
+            generate_report(day, str(path))
+            version_path.write_text(version, encoding="utf-8")
     duration_ms = int((time.perf_counter() - started) * 1000)
-    print(f"[report] day={day} duration_ms={duration_ms}")
+    print(f"[report] day={day} cached={cached} duration_ms={duration_ms}")
     response = FileResponse(path, media_type="application/pdf", filename=path.name)
     response.headers["X-Report-Gen-Ms"] = str(duration_ms)
     return response
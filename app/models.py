@@ -3,8 +3,10 @@ from __future__ import annotations
 from sqlalchemy import (
     Boolean,
     Column,
+    Computed,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     UniqueConstraint,
@@ -14,6 +16,9 @@ from datetime import datetime
 
 from .db import Base
 
+# Stored generated column: SQLite keeps total in sync with the scores
+_TOTAL_EXPR = "physics_ikt + russian + math + achievements"
+
 
 class Program(Base):
     __tablename__ = "programs"
@@ -37,7 +42,11 @@ class Snapshot(Base):
     day = Column(String, nullable=False, index=True)
     imported_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
-    applications = relationship("ApplicationSnapshot", back_populates="snapshot")
+    # Nothing walks these per row; raise instead of silently issuing a
+    # SELECT per object if a caller starts to
+    applications = relationship(
+        "ApplicationSnapshot", back_populates="snapshot", lazy="raise"
+    )
 
 
 class ApplicationSnapshot(Base):
@@ -54,12 +63,14 @@ class ApplicationSnapshot(Base):
     russian = Column(Integer, nullable=False)
     math = Column(Integer, nullable=False)
     achievements = Column(Integer, nullable=False)
-    total = Column(Integer, nullable=False)
+    total = Column(Integer, Computed(_TOTAL_EXPR, persisted=True), nullable=False)
 
-    snapshot = relationship("Snapshot", back_populates="applications")
+    snapshot = relationship("Snapshot", back_populates="applications", lazy="raise")
 
     __table_args__ = (
         UniqueConstraint("snapshot_id", "applicant_id", "program_id", name="uq_snapshot_app_program"),
+        # matches the per-program page query: filter + ORDER BY total DESC, applicant_id
+        Index("ix_snap_prog_total_aid", snapshot_id, program_id, total.desc(), applicant_id),
     )
 
 
@@ -76,7 +87,7 @@ class Application(Base):
     russian = Column(Integer, nullable=False)
     math = Column(Integer, nullable=False)
     achievements = Column(Integer, nullable=False)
-    total = Column(Integer, nullable=False)
+    total = Column(Integer, Computed(_TOTAL_EXPR, persisted=True), nullable=False)
     day = Column(String, nullable=False, index=True)
 
     __table_args__ = (
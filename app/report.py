@@ -2,14 +2,16 @@ from __future__ import annotations
 
 import io
 import os
+import threading
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List
 
 import matplotlib
-
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
@@ -20,23 +22,33 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 from sqlalchemy import select
 
-from .admission import compute_admission
+from .admission import compute_admissions, get_latest_snapshot_id, get_program_codes
 from .config import DAY_LABELS, DAYS, PROGRAMS
 from .db import SessionLocal
-from .models import ApplicationSnapshot, Program, Snapshot
+from .models import ApplicationSnapshot
 
 rl_config.defaultCompression = 0
 
+# Positions used more than once, in points: margins, line and heading steps,
+# table columns and page-break thresholds. One-off section gaps stay inline.
+_LEFT = 15 * mm
+_TOP = 15 * mm
+_LINE = 4 * mm
+_HEADING_GAP = 6 * mm
+_PAGE_BOTTOM = 30 * mm
+_PROGRAM_BREAK = 40 * mm
+_STATS_BREAK = 60 * mm
+_TOTAL_X = 45 * mm
+_TOTAL_OFFSET = _TOTAL_X - _LEFT
+_CUTOFF_X = tuple(x * mm for x in (15, 45, 65, 90))
+_STATS_X = tuple(x * mm for x in (15, 45, 70, 85, 97, 109, 121, 137, 152, 167, 182))
 
-def _get_latest_snapshot_id(db, day: str) -> int | None:
-    stmt = (
-        select(Snapshot)
-        .where(Snapshot.day == day)
-        .order_by(Snapshot.imported_at.desc())
-        .limit(1)
-    )
-    snap = db.execute(stmt).scalars().first()
-    return snap.id if snap else None
+matplotlib.rcParams["font.family"] = "DejaVu Sans"
+
+# The chart figure is built once and redrawn for every report. It is a plain
+# Figure, not a pyplot one, so it never lands in pyplot's global registry.
+_chart: Figure | None = None
+_chart_lock = threading.Lock()
 
 
 def _register_font(name: str, path: Path) -> bool:
@@ -60,6 +72,8 @@ def _register_font_pair(regular_path: Path, bold_path: Path) -> tuple[str, str]
     return "UI-Regular", "UI-Bold"
 
 
+# Font files and registrations do not change while the process runs
+@lru_cache(maxsize=1)
 def _get_fonts() -> tuple[str, str]:
     windir = Path(os.environ.get("WINDIR", r"C:\Windows"))
     pair = _register_font_pair(
@@ -81,22 +95,34 @@ def _get_fonts() -> tuple[str, str]:
 
 
 def _plot_cutoffs(cutoff_series: Dict[str, List[int | None]]) -> io.BytesIO:
-    plt.rcParams["font.family"] = "DejaVu Sans"
+    global _chart
     labels = [DAY_LABELS[d] for d in DAYS]
 
-    plt.figure(figsize=(6.5, 3.2), dpi=150)
-    for code, series in cutoff_series.items():
-        values = [v if v is not None else 0 for v in series]
-        plt.plot(labels, values, marker="o", label=code)
-    plt.title("Динамика проходных")
-    plt.xlabel("День")
-    plt.ylabel("Проходной (0 = НЕДОБОР)")
-    plt.grid(True, alpha=0.3)
-    plt.legend(loc="upper left", fontsize=7)
     buf = io.BytesIO()
-    plt.tight_layout()
-    plt.savefig(buf, format="png")
-    plt.close()
+    with _chart_lock:
+        if _chart is None:
+            _chart = Figure(figsize=(6.5, 3.2), dpi=150)
+            FigureCanvasAgg(_chart)
+            _chart.add_subplot()
+        ax = _chart.axes[0]
+        ax.clear()
+        # one row per program; a single plot call creates all the lines
+        values = np.array(
+            [[v if v is not None else 0 for v in series] for series in cutoff_series.values()]
+        )
+        lines = ax.plot(labels, values.T, marker="o")
+        ax.set_title("Динамика проходных")
+        ax.set_xlabel("День")
+        ax.set_ylabel("Проходной (0 = НЕДОБОР)")
+        ax.grid(True, alpha=0.3)
+        ax.legend(lines, list(cutoff_series), loc="upper left", fontsize=7)
+        _chart.tight_layout()
+        # JPEG encodes faster than PNG and reportlab embeds it as-is (DCTDecode)
+        _chart.savefig(
+            buf,
+            format="jpg",
+            pil_kwargs={"quality": 82, "optimize": False, "progressive": False},
+        )
     buf.seek(0)
     return buf
 
@@ -113,48 +139,62 @@ def _display_cutoff(res) -> int | None:
 def generate_report(day: str, output_path: str) -> None:
     font_regular, font_bold = _get_fonts()
     with SessionLocal() as db:
-        snapshot_id = _get_latest_snapshot_id(db, day)
+        snapshot_id = get_latest_snapshot_id(db, day)
         if snapshot_id is None:
             raise ValueError(f"No snapshot for day {day}")
 
-        programs = {p.id: p for p in db.execute(select(Program)).scalars().all()}
-        program_code_by_id = {p.id: p.code for p in programs.values()}
+        program_code_by_id = get_program_codes(db)
 
-        admission = compute_admission(day, db=db)
+        # One admission run per day, shared by the tables and the chart
+        admissions_by_day = compute_admissions(DAYS, db=db)
+        admission = admissions_by_day[day]
 
         # Build cutoff series across all days
-        cutoff_series = {code: [] for code in PROGRAMS}
-        for d in DAYS:
-            res = compute_admission(d, db=db)
-            for code in PROGRAMS:
-                cutoff_series[code].append(_display_cutoff(res[code]))
+        cutoff_series = {
+            code: [_display_cutoff(admissions_by_day[d][code]) for d in DAYS]
+            for code in PROGRAMS
+        }
 
-        # Load applications for stats
+        # Stream the three columns the stats need as plain tuples; no ORM
+        # objects and no full list of the day's rows
         apps = db.execute(
-            select(ApplicationSnapshot).where(ApplicationSnapshot.snapshot_id == snapshot_id)
-        ).scalars().all()
-
+            select(
+                ApplicationSnapshot.applicant_id,
+                ApplicationSnapshot.program_id,
+                ApplicationSnapshot.priority,
+            )
+            .where(ApplicationSnapshot.snapshot_id == snapshot_id)
+            .execution_options(yield_per=1000)
+        )
+
+        # Single pass over the day's rows: priority buckets plus a per-program
+        # applicant -> priority map for the admitted counts below
         stats = {code: {"total": 0, "priority": {1: 0, 2: 0, 3: 0, 4: 0}} for code in PROGRAMS}
-        priority_lookup = {}
-        for app in apps:
-            code = program_code_by_id[app.program_id]
+        prio_by_code: Dict[str, Dict[int, int]] = {code: {} for code in PROGRAMS}
+        for applicant_id, program_id, priority in apps:
+            code = program_code_by_id[program_id]
             stats[code]["total"] += 1
-            stats[code]["priority"][app.priority] += 1
-            priority_lookup[(app.applicant_id, code)] = app.priority
+            stats[code]["priority"][priority] += 1
+            prio_by_code[code][applicant_id] = priority
 
         admitted_priority = {code: {1: 0, 2: 0, 3: 0, 4: 0} for code in PROGRAMS}
         for code, res in admission.items():
+            priority_of = prio_by_code[code]
+            counts = admitted_priority[code]
             for aid, _total in res.admitted:
-                p = priority_lookup.get((aid, code))
+                p = priority_of.get(aid)
                 if p is not None:
-                    admitted_priority[code][p] += 1
+                    counts[p] += 1
 
         # Prepare plot
         plot_buf = _plot_cutoffs(cutoff_series)
 
-        c = canvas.Canvas(output_path, pagesize=A4)
+        # Built in memory and written in one go; a reader of output_path
+        # never sees a half-written file
+        pdf_buf = io.BytesIO()
+        c = canvas.Canvas(pdf_buf, pagesize=A4)
         width, height = A4
-        y = height - 15 * mm
+        y = height - _TOP
 
         # Hidden markers for selfcheck
         c.setFont("Helvetica", 1)
@@ -164,75 +204,83 @@ def generate_report(day: str, output_path: str) -> None:
         c.setFont(font_regular, 9)
 
         c.setFont(font_bold, 14)
-        c.drawString(15 * mm, y, f"Отчет о поступлении — {day}")
+        c.drawString(_LEFT, y, f"Отчет о поступлении — {day}")
         y -= 7 * mm
         c.setFont(font_regular, 9)
-        c.drawString(15 * mm, y, f"Сформирован: {datetime.utcnow():%Y-%m-%d %H:%M:%S} UTC")
+        c.drawString(_LEFT, y, f"Сформирован: {datetime.utcnow():%Y-%m-%d %H:%M:%S} UTC")
         y -= 10 * mm
 
         # Cutoffs table
         c.setFont(font_bold, 11)
-        c.drawString(15 * mm, y, "Проходные")
-        y -= 6 * mm
+        c.drawString(_LEFT, y, "Проходные")
+        y -= _HEADING_GAP
         c.setFont(font_regular, 9)
-        c.drawString(15 * mm, y, "Программа")
-        c.drawString(45 * mm, y, "Места")
-        c.drawString(65 * mm, y, "Согласия")
-        c.drawString(90 * mm, y, "Проходной")
-        y -= 4 * mm
+        for x, text in zip(_CUTOFF_X, ("Программа", "Места", "Согласия", "Проходной")):
+            c.drawString(x, y, text)
+        y -= _LINE
+        day_idx = DAYS.index(day)
         for code in PROGRAMS:
             res = admission[code]
-            display_cutoff = _display_cutoff(res)
+            display_cutoff = cutoff_series[code][day_idx]
             cutoff_text = str(display_cutoff) if display_cutoff is not None else "НЕДОБОР"
-            c.drawString(15 * mm, y, code)
-            c.drawString(45 * mm, y, str(PROGRAMS[code]["seats"]))
-            c.drawString(65 * mm, y, str(res.consent_count))
-            c.drawString(90 * mm, y, cutoff_text)
-            y -= 4 * mm
+            row = (code, str(PROGRAMS[code]["seats"]), str(res.consent_count), cutoff_text)
+            for x, text in zip(_CUTOFF_X, row):
+                c.drawString(x, y, text)
+            y -= _LINE
 
-        y -= 4 * mm
+        y -= _LINE
         c.setFont(font_bold, 11)
-        c.drawString(15 * mm, y, "Динамика проходных")
+        c.drawString(_LEFT, y, "Динамика проходных")
         y -= 3 * mm
         chart = ImageReader(plot_buf)
-        c.drawImage(chart, 15 * mm, y - 70 * mm, width=170 * mm, height=70 * mm)
+        c.drawImage(chart, _LEFT, y - 70 * mm, width=170 * mm, height=70 * mm)
         y -= 78 * mm
 
         # Admitted lists
         c.setFont(font_bold, 11)
-        c.drawString(15 * mm, y, "Списки зачисленных")
-        y -= 6 * mm
+        c.drawString(_LEFT, y, "Списки зачисленных")
+        y -= _HEADING_GAP
         c.setFont(font_regular, 9)
 
         for code in PROGRAMS:
             res = admission[code]
-            c.drawString(15 * mm, y, f"Программа {code}")
-            y -= 4 * mm
-            c.drawString(15 * mm, y, "ID абитуриента")
-            c.drawString(45 * mm, y, "Сумма")
-            y -= 4 * mm
+            c.drawString(_LEFT, y, f"Программа {code}")
+            y -= _LINE
+            c.drawString(_LEFT, y, "ID абитуриента")
+            c.drawString(_TOTAL_X, y, "Сумма")
+            y -= _LINE
+            # One text object per page: rows become relative cursor moves
+            # inside a single BT/ET block instead of two drawStrings each
+            text = c.beginText(_LEFT, y)
+            text.setFont(font_regular, 9)
             for aid, total in res.admitted:
-                c.drawString(15 * mm, y, str(aid))
-                c.drawString(45 * mm, y, str(total))
-                y -= 4 * mm
-                if y < 30 * mm:
+                text.textOut(str(aid))
+                text.moveCursor(_TOTAL_OFFSET, 0)
+                text.textOut(str(total))
+                text.moveCursor(-_TOTAL_OFFSET, _LINE)
+                y -= _LINE
+                if y < _PAGE_BOTTOM:
+                    c.drawText(text)
                     c.showPage()
-                    y = height - 15 * mm
+                    y = height - _TOP
                     c.setFont(font_regular, 9)
-            y -= 4 * mm
-            if y < 40 * mm:
+                    text = c.beginText(_LEFT, y)
+                    text.setFont(font_regular, 9)
+            c.drawText(text)
+            y -= _LINE
+            if y < _PROGRAM_BREAK:
                 c.showPage()
-                y = height - 15 * mm
+                y = height - _TOP
                 c.setFont(font_regular, 9)
 
         # Statistics table
-        if y < 60 * mm:
+        if y < _STATS_BREAK:
             c.showPage()
-            y = height - 15 * mm
+            y = height - _TOP
 
         c.setFont(font_bold, 11)
-        c.drawString(15 * mm, y, "Статистика")
-        y -= 6 * mm
+        c.drawString(_LEFT, y, "Статистика")
+        y -= _HEADING_GAP
         c.setFont(font_regular, 8)
         header = [
             "Программа",
@@ -247,10 +295,9 @@ def generate_report(day: str, output_path: str) -> None:
             "Зач. П3",
             "Зач. П4",
         ]
-        x_positions = [15, 45, 70, 85, 97, 109, 121, 137, 152, 167, 182]
-        for x, text in zip(x_positions, header):
-            c.drawString(x * mm, y, text)
-        y -= 4 * mm
+        for x, text in zip(_STATS_X, header):
+            c.drawString(x, y, text)
+        y -= _LINE
 
         for code in PROGRAMS:
             row = [
@@ -266,8 +313,12 @@ def generate_report(day: str, output_path: str) -> None:
                 str(admitted_priority[code][3]),
                 str(admitted_priority[code][4]),
             ]
-            for x, text in zip(x_positions, row):
-                c.drawString(x * mm, y, text)
-            y -= 4 * mm
+            for x, text in zip(_STATS_X, row):
+                c.drawString(x, y, text)
+            y -= _LINE
 
         c.save()
+
+    tmp_path = Path(f"{output_path}.tmp")
+    tmp_path.write_bytes(pdf_buf.getvalue())
+    os.replace(tmp_path, output_path)
@@ -1,17 +1,19 @@
 from __future__ import annotations
 
-import csv
 import math
 import random
 from pathlib import Path
 from typing import Dict, List, Tuple
 
+import numpy as np
+
 SEED = 20250801
 
 PROGRAMS = ["PM", "IVT", "ITSS", "IB"]
 PROGRAM_BITS = {"PM": 1, "IVT": 2, "ITSS": 4, "IB": 8}
 BITS_PROGRAM = {v: k for k, v in PROGRAM_BITS.items()}
 PROGRAM_ORDER = ["PM", "IVT", "ITSS", "IB"]
+PROGRAM_INDEX = {p: i for i, p in enumerate(PROGRAM_ORDER)}
 
 DAYS = [
     "2025-08-01",
@@ -19,6 +21,7 @@ DAYS = [
     "2025-08-03",
     "2025-08-04",
 ]
+DAY_INDEX = {d: i for i, d in enumerate(DAYS)}
 DAY_FOLDERS = {
     "2025-08-01": "day_01",
     "2025-08-02": "day_02",
@@ -116,8 +119,14 @@ CONSENT_TARGETS = {
 }
 
 
-def popcount(x: int) -> int:
-    return bin(x).count("1")
+_CSV_HEADER = "applicant_id,consent,priority,physics_ikt,russian,math,achievements,total"
+
+# Number of programs in a 4-bit program mask
+_POP = (0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 4)
+
+
+# _MASK_BITS[mask][k] is bit k of a 4-bit program mask
+_MASK_BITS = np.array([[(m >> k) & 1 for k in range(4)] for m in range(16)], dtype=np.int64)
 
 
 def compute_region_counts(spec: Dict) -> Dict[int, int]:
@@ -164,6 +173,90 @@ def compute_region_counts(spec: Dict) -> Dict[int, int]:
     return counts
 
 
+def _swap_delta(
+    prev_a: np.ndarray, prev_b: np.ndarray, slot_a: np.ndarray, slot_b: np.ndarray
+) -> np.ndarray:
+    # Change of the per-program removal counts when the applicants holding
+    # slots a and b trade places; works element-wise on arrays of swaps
+    return (
+        _MASK_BITS[prev_a & ~slot_b]
+        + _MASK_BITS[prev_b & ~slot_a]
+        - _MASK_BITS[prev_a & ~slot_a]
+        - _MASK_BITS[prev_b & ~slot_b]
+    )
+
+
+def _violation(rem: np.ndarray, min_remove: np.ndarray, max_remove: np.ndarray) -> np.ndarray:
+    return np.maximum(0, min_remove - rem) + np.maximum(0, rem - max_remove)
+
+
+def _swap_search(
+    slot_arr: np.ndarray,
+    slot_prev: np.ndarray,
+    slot_to_app: np.ndarray,
+    min_remove: np.ndarray,
+    max_remove: np.ndarray,
+    rng: np.random.Generator,
+    max_iters: int = 30000,
+) -> bool:
+    """Swap applicants between slots until every removal count is in bounds.
+
+    slot_prev holds the previous-day mask of the applicant in each slot and
+    is swapped along with slot_to_app, both in place. Returns whether the
+    search reached zero penalty.
+    """
+    bits = [1, 2, 4, 8]
+    removed = _MASK_BITS[slot_prev & ~slot_arr].sum(axis=0)
+    pen = int(_violation(removed, min_remove, max_remove).sum())
+    if pen == 0:
+        return True
+
+    slots_with = [np.flatnonzero(slot_arr & b) for b in bits]
+    slots_without = [np.flatnonzero((slot_arr & b) == 0) for b in bits]
+
+    for _ in range(max_iters):
+        # choose program with largest violation
+        k = int(_violation(removed, min_remove, max_remove).argmax())
+        b = bits[k]
+        need_more = removed[k] < min_remove[k]
+        candidates_a = slots_with[k] if need_more else slots_without[k]
+        candidates_b = slots_without[k] if need_more else slots_with[k]
+
+        # Score 60 random swaps at once; only swaps whose slot-a applicant
+        # had program b can move its removal count
+        sa = candidates_a[rng.integers(0, len(candidates_a), 60)]
+        sb = candidates_b[rng.integers(0, len(candidates_b), 60)]
+        prev_a = slot_prev[sa]
+        prev_b = slot_prev[sb]
+        new_removed = removed + _swap_delta(prev_a, prev_b, slot_arr[sa], slot_arr[sb])
+        new_pen = np.where(
+            (sa != sb) & (prev_a & b != 0),
+            _violation(new_removed, min_remove, max_remove).sum(axis=1),
+            pen,
+        )
+        best = int(new_pen.argmin())
+
+        if new_pen[best] < pen:
+            sa, sb = sa[best], sb[best]
+            removed = new_removed[best]
+            pen = int(new_pen[best])
+        else:
+            # random swap to escape
+            sa, sb = rng.integers(0, len(slot_arr), 2)
+            if sa == sb:
+                continue
+            removed = removed + _swap_delta(
+                slot_prev[sa], slot_prev[sb], slot_arr[sa], slot_arr[sb]
+            )
+            pen = int(_violation(removed, min_remove, max_remove).sum())
+        slot_to_app[[sa, sb]] = slot_to_app[[sb, sa]]
+        slot_prev[[sa, sb]] = slot_prev[[sb, sa]]
+        if pen == 0:
+            return True
+
+    return False
+
+
 def assign_new_day(
     prev_assignments: Dict[int, int],
     target_counts: Dict[int, int],
@@ -180,156 +273,42 @@ def assign_new_day(
             if mask & b:
                 sizes[b] += 1
 
-    min_remove = {b: math.ceil(0.05 * sizes[b]) for b in bits}
-    max_remove = {b: math.floor(0.10 * sizes[b]) for b in bits}
+    # Removal bounds are arrays indexed by bit position
+    min_remove = np.array([math.ceil(0.05 * sizes[b]) for b in bits])
+    max_remove = np.array([math.floor(0.10 * sizes[b]) for b in bits])
     total_slots = sum(target_counts.values())
     new_count = total_slots - len(prev_ids)
     if new_count < 0:
         raise RuntimeError("Target slots less than previous applicants")
 
-    for attempt in range(25):
-        rng = random.Random(seed_base + attempt)
+    # Build applicants list (prev + new); only the seed changes between attempts
+    new_ids = list(range(next_id, next_id + new_count))
+    app_ids = prev_ids + new_ids
+    app_prev_mask = [prev_assignments[aid] for aid in prev_ids] + [0] * new_count
 
-        # Build applicants list (prev + new)
-        new_ids = list(range(next_id, next_id + new_count))
-        app_ids = prev_ids + new_ids
-        app_prev_mask = [prev_assignments[aid] for aid in prev_ids] + [0] * new_count
+    slots: List[int] = []
+    for mask, count in target_counts.items():
+        slots.extend([mask] * count)
 
-        slots: List[int] = []
-        for mask, count in target_counts.items():
-            slots.extend([mask] * count)
-
-        # Initial assignment: sort by popcount
-        app_order = sorted(
-            range(len(app_ids)),
-            key=lambda i: (-popcount(app_prev_mask[i]), app_ids[i]),
-        )
-        slot_order = sorted(range(len(slots)), key=lambda i: -popcount(slots[i]))
-        slot_to_app = [0] * len(slots)
-        app_to_slot = [0] * len(app_ids)
-        for app_idx, slot_idx in zip(app_order, slot_order):
-            slot_to_app[slot_idx] = app_idx
-            app_to_slot[app_idx] = slot_idx
-
-        removed = {b: 0 for b in bits}
-        for slot_idx, app_idx in enumerate(slot_to_app):
-            prev_mask = app_prev_mask[app_idx]
-            slot_mask = slots[slot_idx]
-            for b in bits:
-                if prev_mask & b and not (slot_mask & b):
-                    removed[b] += 1
-
-        def penalty(rem: Dict[int, int]) -> int:
-            return sum(
-                max(0, min_remove[b] - rem[b]) + max(0, rem[b] - max_remove[b]) for b in bits
-            )
-
-        pen = penalty(removed)
-        if pen == 0:
-            if any(removed[b] < min_remove[b] or removed[b] > max_remove[b] for b in bits):
-                continue
-            assignments = {app_ids[slot_to_app[i]]: slots[i] for i in range(len(slots))}
-            return assignments, next_id + new_count
-
-        slots_with = {b: [i for i, m in enumerate(slots) if m & b] for b in bits}
-        slots_without = {b: [i for i, m in enumerate(slots) if not (m & b)] for b in bits}
-
-        max_iters = 30000
-        for _ in range(max_iters):
-            if pen == 0:
-                break
-
-            # choose program with largest violation
-            def violation(b: int) -> int:
-                if removed[b] < min_remove[b]:
-                    return min_remove[b] - removed[b]
-                if removed[b] > max_remove[b]:
-                    return removed[b] - max_remove[b]
-                return 0
-
-            b = max(bits, key=violation)
-            if violation(b) == 0:
-                break
-
-            need_more = removed[b] < min_remove[b]
-            candidates_a = slots_with[b] if need_more else slots_without[b]
-            candidates_b = slots_without[b] if need_more else slots_with[b]
-
-            best_swap = None
-            best_pen = pen
-
-            for _t in range(60):
-                sa = rng.choice(candidates_a)
-                sb = rng.choice(candidates_b)
-                if sa == sb:
-                    continue
-                app_a = slot_to_app[sa]
-                app_b = slot_to_app[sb]
-                prev_a = app_prev_mask[app_a]
-                prev_b = app_prev_mask[app_b]
-                # Ensure swap can influence program b
-                if need_more and not (prev_a & b):
-                    continue
-                if not need_more and not (prev_a & b):
-                    continue
+    # Initial assignment: sort by popcount
+    app_order = sorted(
+        range(len(app_ids)),
+        key=lambda i: (-_POP[app_prev_mask[i]], app_ids[i]),
+    )
+    slot_order = sorted(range(len(slots)), key=lambda i: -_POP[slots[i]])
+    initial_slot_to_app = np.empty(len(slots), dtype=np.intp)
+    initial_slot_to_app[slot_order] = app_order
 
-                # compute new removed counts
-                new_removed = removed.copy()
-                for bit in bits:
-                    old = 0
-                    new = 0
-                    if prev_a & bit and not (slots[sa] & bit):
-                        old += 1
-                    if prev_b & bit and not (slots[sb] & bit):
-                        old += 1
-                    if prev_a & bit and not (slots[sb] & bit):
-                        new += 1
-                    if prev_b & bit and not (slots[sa] & bit):
-                        new += 1
-                    new_removed[bit] = new_removed[bit] - old + new
-
-                new_pen = penalty(new_removed)
-                if new_pen < best_pen:
-                    best_pen = new_pen
-                    best_swap = (sa, sb, new_removed)
-                    if best_pen == 0:
-                        break
-
-            if best_swap is None:
-                # random swap to escape
-                sa = rng.randrange(len(slots))
-                sb = rng.randrange(len(slots))
-                if sa != sb:
-                    app_a = slot_to_app[sa]
-                    app_b = slot_to_app[sb]
-                    new_removed = removed.copy()
-                    for bit in bits:
-                        old = 0
-                        new = 0
-                        if app_prev_mask[app_a] & bit and not (slots[sa] & bit):
-                            old += 1
-                        if app_prev_mask[app_b] & bit and not (slots[sb] & bit):
-                            old += 1
-                        if app_prev_mask[app_a] & bit and not (slots[sb] & bit):
-                            new += 1
-                        if app_prev_mask[app_b] & bit and not (slots[sa] & bit):
-                            new += 1
-                        new_removed[bit] = new_removed[bit] - old + new
-                    slot_to_app[sa], slot_to_app[sb] = app_b, app_a
-                    removed = new_removed
-                    pen = penalty(removed)
-            else:
-                sa, sb, new_removed = best_swap
-                app_a = slot_to_app[sa]
-                app_b = slot_to_app[sb]
-                slot_to_app[sa], slot_to_app[sb] = app_b, app_a
-                removed = new_removed
-                pen = best_pen
+    slot_arr = np.array(slots, dtype=np.uint8)
+    initial_slot_prev = np.array(app_prev_mask, dtype=np.uint8)[initial_slot_to_app]
 
-        if pen == 0:
-            if any(removed[b] < min_remove[b] or removed[b] > max_remove[b] for b in bits):
-                continue
-            assignments = {app_ids[slot_to_app[i]]: slots[i] for i in range(len(slots))}
+    for attempt in range(25):
+        rng = np.random.default_rng(seed_base + attempt)
+        # the search swaps in place, so every attempt starts from a copy
+        slot_to_app = initial_slot_to_app.copy()
+        slot_prev = initial_slot_prev.copy()
+        if _swap_search(slot_arr, slot_prev, slot_to_app, min_remove, max_remove, rng):
+            assignments = {app_ids[a]: slots[i] for i, a in enumerate(slot_to_app.tolist())}
             return assignments, next_id + new_count
 
     raise RuntimeError("Failed to assign applicants within constraints")
@@ -346,10 +325,11 @@ def assign_consents(
     forced_top: Dict[str, List[int]] = {p: [] for p in PROGRAMS}
 
     degrees = {aid: len(progs) for aid, progs in applicant_programs.items()}
-    candidates_by_program = {
-        p: sorted([aid for aid, progs in applicant_programs.items() if p in progs])
-        for p in PROGRAMS
-    }
+    # one sort of all ids; each program's list inherits the order
+    candidates_by_program: Dict[str, List[int]] = {p: [] for p in PROGRAMS}
+    for aid in sorted(applicant_programs):
+        for p in applicant_programs[aid]:
+            candidates_by_program[p].append(aid)
 
     assigned = set()
 
@@ -378,7 +358,7 @@ def assign_consents(
                 forced_priorities[(candidate, program)] = desired
                 forced_top[program].append(candidate)
 
-    rng = random.Random(SEED + DAYS.index(day) * 1000 + 77)
+    rng = random.Random(SEED + DAY_INDEX[day] * 1000 + 77)
     ids = sorted(applicant_programs.keys())
     rng.shuffle(ids)
 
@@ -388,7 +368,7 @@ def assign_consents(
         choices = [p for p in applicant_programs[aid] if remaining[p] > 0]
         if not choices:
             continue
-        choices.sort(key=lambda p: (-remaining[p], PROGRAM_ORDER.index(p)))
+        choices.sort(key=lambda p: (-remaining[p], PROGRAM_INDEX[p]))
         chosen = choices[0]
         consent_of[aid] = chosen
         assigned.add(aid)
@@ -409,60 +389,69 @@ def assign_priorities(
     priority_overrides: Dict[Tuple[int, str], int] | None = None,
 ) -> Dict[Tuple[int, str], int]:
     priorities: Dict[Tuple[int, str], int] = {}
-    day_idx = DAYS.index(day)
+    day_idx = DAY_INDEX[day]
     overrides = priority_overrides or {}
 
-    for aid, programs in applicant_programs.items():
+    # One generator for the day: every applicant's shuffle reads the argsort
+    # of its own row of random keys, drawn in a single call
+    rng = np.random.default_rng(SEED + day_idx * 100000)
+    shuffles = np.argsort(rng.random((len(applicant_programs), 4)), axis=1).tolist()
+
+    for (aid, programs), order in zip(applicant_programs.items(), shuffles):
         programs = list(programs)
-        rng = random.Random(SEED + day_idx * 100000 + aid)
         if aid in consent_of:
             consent_program = consent_of[aid]
             remaining = [p for p in programs if p != consent_program]
-            rng.shuffle(remaining)
+            remaining = [remaining[j] for j in order if j < len(remaining)]
             desired = overrides.get((aid, consent_program))
             if desired is not None and 1 <= desired <= len(programs):
                 pos = desired - 1
                 ordered = remaining[:pos] + [consent_program] + remaining[pos:]
+            elif desired is not None and len(programs) < desired <= 4:
+                # forced priority beyond the applicant's own program count:
+                # it is kept as is and the other programs follow from 2
+                priorities[(aid, consent_program)] = desired
+                for i, p in enumerate(remaining, start=2):
+                    priorities[(aid, p)] = i
+                continue
             else:
                 ordered = [consent_program] + remaining
         else:
-            rng.shuffle(programs)
-            ordered = programs
+            ordered = [programs[j] for j in order if j < len(programs)]
         for i, p in enumerate(ordered, start=1):
             priorities[(aid, p)] = i
-        if aid in consent_of and (aid, consent_of[aid]) in overrides:
-            desired = overrides[(aid, consent_of[aid])]
-            if 1 <= desired <= 4:
-                priorities[(aid, consent_of[aid])] = desired
     return priorities
 
 
-def split_total(total: int, rng: random.Random) -> Tuple[int, int, int, int]:
-    achievements = total % 11
-    rem = total - achievements
-    extra = rem - 150
-    extras = [0, 0, 0]
-    for i in range(3):
-        max_add = min(50, extra)
-        add = rng.randint(0, max_add) if max_add > 0 else 0
-        extras[i] = add
-        extra -= add
-    i = 0
-    while extra > 0:
-        if extras[i] < 50:
-            extras[i] += 1
-            extra -= 1
-        i = (i + 1) % 3
-    physics = 50 + extras[0]
-    russian = 50 + extras[1]
-    math = 50 + extras[2]
+def split_totals(
+    totals: np.ndarray, rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    achievements = totals % 11
+    extra = totals - achievements - 150
+    extras = []
+    for _ in range(3):
+        add = rng.integers(0, np.clip(extra, 0, 50), endpoint=True)
+        extras.append(add)
+        extra = extra - add
+    # Hand out what is left one point at a time, round-robin over the
+    # subjects still under the 50-point cap; one vectorized step per point
+    while extra.any():
+        for i in range(3):
+            add = (extra > 0) & (extras[i] < 50)
+            extras[i] = extras[i] + add
+            extra = extra - add
+    physics, russian, math = (50 + e for e in extras)
     return physics, russian, math, achievements
 
 
-def total_for_rank(rank: int, seats: int, cutoff: int, min_total: int = 160) -> int:
-    if rank <= seats:
-        return cutoff + (seats - rank)
-    return max(cutoff - 1 - (rank - seats - 1), min_total)
+def totals_for_ranks(
+    ranks: np.ndarray, seats: int, cutoff: int, min_total: int = 160
+) -> np.ndarray:
+    return np.where(
+        ranks <= seats,
+        cutoff + (seats - ranks),
+        np.maximum(cutoff - 1 - (ranks - seats - 1), min_total),
+    )
 
 
 def generate_day_csvs(day: str, assignments: Dict[int, int], output_dir: str) -> None:
@@ -485,51 +474,50 @@ def generate_day_csvs(day: str, assignments: Dict[int, int], output_dir: str) ->
         applicant_programs, consent_of, day, priority_overrides=forced_priorities
     )
 
-    day_idx = DAYS.index(day)
+    day_idx = DAY_INDEX[day]
 
     for program in PROGRAMS:
         seats = {"PM": 40, "IVT": 50, "ITSS": 30, "IB": 20}[program]
         cutoff = TARGET_CUTOFFS[day][program]
+        # both lists keep the sorted order of applicants
         applicants = sorted(program_applicants[program])
         consented = [aid for aid in applicants if consent_of.get(aid) == program]
         non_consented = [aid for aid in applicants if consent_of.get(aid) != program]
-        consented.sort()
         forced = sorted(forced_top.get(program, []))
         if forced:
             forced_set = set(forced)
             consented = forced + [aid for aid in consented if aid not in forced_set]
-        non_consented.sort()
         ranked = consented + non_consented
 
-        scores_by_applicant: Dict[int, Tuple[int, int, int, int, int]] = {}
-        for idx, aid in enumerate(ranked, start=1):
-            total = total_for_rank(idx, seats, cutoff)
-            rng = random.Random(SEED + day_idx * 100000 + PROGRAM_ORDER.index(program) * 1000 + aid)
-            physics, russian, math, achievements = split_total(total, rng)
-            scores_by_applicant[aid] = (physics, russian, math, achievements, total)
+        totals = totals_for_ranks(np.arange(1, len(ranked) + 1), seats, cutoff)
+        rng = np.random.default_rng(SEED + day_idx * 100000 + PROGRAM_INDEX[program] * 1000)
+        physics, russian, math, achievements = split_totals(totals, rng)
+        scores_by_applicant: Dict[int, Tuple[int, int, int, int, int]] = dict(
+            zip(
+                ranked,
+                zip(
+                    physics.tolist(),
+                    russian.tolist(),
+                    math.tolist(),
+                    achievements.tolist(),
+                    totals.tolist(),
+                ),
+            )
+        )
 
-        path = folder / f"{program}.csv"
-        with path.open("w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(
-                [
-                    "applicant_id",
-                    "consent",
-                    "priority",
-                    "physics_ikt",
-                    "russian",
-                    "math",
-                    "achievements",
-                    "total",
-                ]
+        # Rows are formatted into one string and written at once; "\r\n"
+        # matches what csv.writer produced
+        lines = [_CSV_HEADER]
+        for aid in applicants:
+            physics, russian, math, achievements, total = scores_by_applicant[aid]
+            consent = 1 if consent_of.get(aid) == program else 0
+            priority = priorities[(aid, program)]
+            lines.append(
+                f"{aid},{consent},{priority},{physics},{russian},{math},{achievements},{total}"
             )
-            for aid in applicants:
-                physics, russian, math, achievements, total = scores_by_applicant[aid]
-                consent = 1 if consent_of.get(aid) == program else 0
-                priority = priorities[(aid, program)]
-                writer.writerow(
-                    [aid, consent, priority, physics, russian, math, achievements, total]
-                )
+        lines.append("")
+        path = folder / f"{program}.csv"
+        path.write_bytes("\r\n".join(lines).encode("utf-8"))
 
 
 def generate(output_dir: str = "data") -> None:
@@ -548,10 +536,10 @@ def generate(output_dir: str = "data") -> None:
     assignments_by_day[day1] = assignments
 
     # Subsequent days
-    for day in DAYS[1:]:
-        prev_day = DAYS[DAYS.index(day) - 1]
+    for day_idx, day in enumerate(DAYS[1:], start=1):
+        prev_day = DAYS[day_idx - 1]
         prev_assignments = assignments_by_day[prev_day]
-        seed_base = SEED + DAYS.index(day) * 10000 + 123
+        seed_base = SEED + day_idx * 10000 + 123
         assignments, next_id = assign_new_day(
             prev_assignments, day_regions[day], next_id, seed_base
         )
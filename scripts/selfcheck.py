@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import csv
+import shutil
 import sys
+import tempfile
 from pathlib import Path
 
 from sqlalchemy import select
@@ -11,7 +13,7 @@ sys.path.insert(0, str(ROOT))
 
 from app.admission import compute_admission
 from app.config import DAYS, PROGRAMS
-from app.importer import import_day, reset_db
+from app.importer import _load_day_rows, import_day, reset_db
 from app.db import SessionLocal
 from app.models import ApplicationSnapshot, Program, Snapshot
 from app.report import generate_report
@@ -127,6 +129,21 @@ def check_updates() -> None:
             )
 
 
+def check_blank_lines() -> None:
+    # csv.reader yields blank lines as empty records; they must not drop the file
+    day = DAYS[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / DAY_FOLDERS[day]
+        shutil.copytree(DATA_DIR / DAY_FOLDERS[day], folder)
+        with (folder / "PM.csv").open("a", encoding="utf-8") as f:
+            f.write("\n")
+        rows = _load_day_rows(day, data_dir=tmp)
+    got = sum(1 for r in rows if r["program_code"] == "PM")
+    expected = len(load_day_program(day, "PM"))
+    if got != expected:
+        raise AssertionError(f"Blank line dropped rows for {day} PM: {got} != {expected}")
+
+
 def check_cutoffs() -> None:
     reset_db()
     results = {}
@@ -258,6 +275,7 @@ def main() -> None:
         ("Sizes", check_sizes),
         ("Intersections", check_intersections),
         ("Updates", check_updates),
+        ("Blank lines", check_blank_lines),
         ("Cutoffs", check_cutoffs),
         ("Statistics non-zero", check_stats_nonzero),
         ("PDF", check_pdf),